@@ -3,12 +3,11 @@
 # takes summary of context
 
 import json
-import traceback
 import utils.llm as llm
 from utils.log import log
 import think.prompt as prompt
 import think.memory as memory
-from utils.log import save_debug
+from utils.log import save_debug, DEBUG
 
 
 fail_counter = 0
@@ -47,11 +46,14 @@ def decide(thoughts):
         assistant_message = response.json()["choices"][0]["message"]["content"]
         log("finished deciding!")
 
-        if not validate_json(assistant_message):
-            assistant_message = extract_json_from_response(assistant_message)
+        # parse once and hand the decoded command on, instead of validating
+        # the raw string and decoding it again later
+        decision = parse_json(assistant_message)
+        if decision is None:
+            decision = parse_json(extract_json_from_response(assistant_message))
 
-        if validate_json(assistant_message):
-            return assistant_message
+        if decision is not None:
+            return decision
         else:
             fail_counter = fail_counter + 1
             if fail_counter >= 5:
@@ -67,17 +69,18 @@ def decide(thoughts):
 
 
 def validate_json(test_response):
-    global fail_counter
+    return parse_json(test_response) is not None
+
 
+def parse_json(test_response):
+    """Decode and validate a command, returning the dict or None if invalid."""
     try:
         if test_response is None:
             log("received empty json?")
-            return False
+            return None
 
         if isinstance(test_response, dict):
             response = test_response
-        elif test_response is str:
-            response = json.load(test_response)
         else:
             response = json.JSONDecoder().decode(test_response)
 
@@ -90,13 +93,13 @@ def validate_json(test_response):
                 # or (isinstance(value, list) and all(validate_json(v) for v in value))
             ):
                 log("type is wrong.")
-                return False
-        return True
+                return None
+        return response
     except Exception as e:
         # log("test response was: \n" + test_response + "\n END of test response")
         # log(traceback.format_exc())
         log(e)
-        return False
+        return None
 
 
 def extract_json_from_response(response_text):
@@ -109,8 +112,9 @@ def extract_json_from_response(response_text):
         try:
             # Parse the JSON string
             parsed_json = json.loads(json_str)
-            # Pretty print the parsed JSON
-            log(json.dumps(parsed_json, indent=4, ensure_ascii=False))
+            # Pretty print the parsed JSON, only when someone is debugging
+            if DEBUG:
+                log(json.dumps(parsed_json, indent=4, ensure_ascii=False))
             return parsed_json
         except json.JSONDecodeError as e:
             log(f"Error parsing JSON: {e}")
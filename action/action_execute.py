@@ -1,37 +1,32 @@
 # import demjson as json
 # import loosejson
-import json
-import time
 import traceback
 from utils.log import log
-from utils.simple_telegram import TelegramUtils
+from utils.simple_telegram import TelegramUtils, get_telegram_config
+from utils.web_search import web_search
 import think.memory as memory
 
-from itertools import islice
-from duckduckgo_search import DDGS
-import os
-
 # import re
 
-from dotenv import load_dotenv
+fail_counter = 0
 
-COMMAND_CATEGORY = "web_search"
-COMMAND_CATEGORY_TITLE = "Web Search"
+telegram = None
 
-DUCKDUCKGO_MAX_ATTEMPTS = 3
 
-fail_counter = 0
+def get_telegram():
+    """Return the shared TelegramUtils, creating it on first use."""
+    global telegram
+    if telegram is None:
+        telegram_api_key, telegram_chat_id = get_telegram_config()
+        telegram = TelegramUtils(api_key=telegram_api_key, chat_id=telegram_chat_id)
+    return telegram
 
 
 def take_action(command):
 # def take_action(assistant_message):
     global fail_counter
-    load_dotenv()
 
-    telegram_api_key = os.getenv("TELEGRAM_API_KEY")
-    telegram_chat_id = os.getenv("TELEGRAM_CHAT_ID")
-
-    telegram = TelegramUtils(api_key=telegram_api_key, chat_id=telegram_chat_id)
+    telegram = get_telegram()
 
     try:
         # command = json.JSONDecoder().decode(assistant_message)
@@ -39,43 +34,10 @@ def take_action(command):
         action = command["command"]["name"]
         content = command["command"]["args"]
 
-        if action == "ask_user":
-            ask_user_response = telegram.ask_user(content["message"])
-            user_response = f"The user's answer: '{ask_user_response}'"
-            print("User responded: " + user_response)
-            if ask_user_response == "/debug":
-                telegram.send_message(str(assistant_message))
-                log("received debug command")
-            memory.add_to_response_history(content["message"], user_response)
-        elif action == "send_message" or action == "send_log":
-            telegram.send_message(content["message"])
-            memory.add_to_response_history(content["message"], "No response.")
-        elif action == "web_search":
-            try:
-                # TODO: use web_search.py, left it here as there was an error when using the imported one
-                query_result = web_search(query=content["query"])
-                log("web search done : " + query_result)
-                memory.add_to_response_history(
-                    question="called web_search: " + content["query"],
-                    response=str(query_result),
-                )
-            except Exception as e:
-                log("Error with websearch!")
-                log(e)
-                log(traceback.format_exc())
-        elif action == "conversation_history":
-            try:
-                conversation_history = "Previous conversation: "
-                conversation_history += str(memory.get_response_history())
-                memory.add_to_response_history(
-                    "called conversation_history", conversation_history
-                )
-            except Exception as e:
-                log("Error retrieving conversation History.")
-                log(e)
-                log(traceback.format_exc())
-        else:
-            log(assistant_message)
+        # look the handler up by command name instead of walking an if/elif chain
+        handler = ACTIONS.get(action)
+        if handler is None:
+            log(command)
             log(
                 "action "
                 + str(action)
@@ -86,6 +48,8 @@ def take_action(command):
             log("Starting again I guess...")
             return
 
+        handler(telegram, command, content)
+
         if fail_counter > 0:
             fail_counter = 0
         log("Added to assistant content.")
@@ -99,48 +63,51 @@ def take_action(command):
         log("END OF ERROR WITHIN JSON RESPONSE!")
 
 
-def safe_google_results(results: str | list):
-    if isinstance(results, list):
-        safe_message = json.dumps(
-            [result.encode("utf-8", "ignore").decode("utf-8") for result in results]
+def ask_user(telegram, command, content):
+    ask_user_response = telegram.ask_user(content["message"])
+    user_response = f"The user's answer: '{ask_user_response}'"
+    print("User responded: " + user_response)
+    if ask_user_response == "/debug":
+        telegram.send_message(str(command))
+        log("received debug command")
+    memory.add_to_response_history(content["message"], user_response)
+
+
+def send_message(telegram, command, content):
+    telegram.send_message(content["message"])
+    memory.add_to_response_history(content["message"], "No response.")
+
+
+def search_web(telegram, command, content):
+    try:
+        query_result = web_search(query=content["query"], num_results=3)
+        log("web search done : " + query_result)
+        memory.add_to_response_history(
+            question="called web_search: " + content["query"],
+            response=str(query_result),
         )
-    else:
-        safe_message = results.encode("utf-8", "ignore").decode("utf-8")
-    return safe_message
-
-
-def web_search(query: str, num_results: int = 3):
-    search_results = []
-    attempts = 0
-
-    while attempts < DUCKDUCKGO_MAX_ATTEMPTS:
-        if not query:
-            return json.dumps(search_results)
-
-        results = DDGS().text(query)
-        search_results = list(islice(results, num_results))
-
-        if search_results:
-            break
-
-        time.sleep(1)
-        attempts += 1
-
-    search_results = [
-        {
-            "title": r["title"],
-            "url": r["href"],
-            **({"exerpt": r["body"]} if r.get("body") else {}),
-        }
-        for r in search_results
-    ]
-
-    results = (
-        "## Search results\n"
-    ) + "\n\n".join(
-        f"### \"{r['title']}\"\n"
-        f"**URL:** {r['url']}  \n"
-        "**Excerpt:** " + (f'"{exerpt}"' if (exerpt := r.get("exerpt")) else "N/A")
-        for r in search_results
-    )
-    return safe_google_results(results)
+    except Exception as e:
+        log("Error with websearch!")
+        log(e)
+        log(traceback.format_exc())
+
+
+def conversation_history(telegram, command, content):
+    try:
+        history_text = "Previous conversation: " + str(memory.get_response_history())
+        memory.add_to_response_history("called conversation_history", history_text)
+    except Exception as e:
+        log("Error retrieving conversation History.")
+        log(e)
+        log(traceback.format_exc())
+
+
+# command name -> handler, built once at import
+ACTIONS = {
+    "ask_user": ask_user,
+    "send_message": send_message,
+    "send_log": send_message,
+    "web_search": search_web,
+    "conversation_history": conversation_history,
+}
+
@@ -1,4 +1,4 @@
-import time
+import sys
 import think.think as think
 import think.memory as memory
 
@@ -8,11 +8,6 @@ import think.memory as memory
 # maybe having it structured like "plan:..." "context: summarized history" and "last few messages: ..." makes more sense?
 
 
-def log(message):
-    # print with white color
-    print("\033[0m" + str(message) + "\033[0m")
-
-
 def write_start_message():
     pic = """                           
                                                  
@@ -47,13 +42,10 @@ I am here to help you and will try to contact you as soon as possible!
 Note: I am still in development, so please be patient with me! <3
 
 """
-    # write the pic in print line by line with a tiny delay between each line, then add the message below as if someone was typing it.
-    for line in pic.split("\n"):
-        print(line)
-        # time.sleep(0.1)
-    for char in message:
-        print(char, end="", flush=True)
-        # time.sleep(0.05)
+    # the typing animation is disabled, so write the banner in one go instead
+    # of flushing the terminal once per character
+    sys.stdout.write(pic + "\n" + message)
+    sys.stdout.flush()
 
 
 def start_mini_autogpt():
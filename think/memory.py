@@ -1,162 +1,234 @@
+import collections
+import hashlib
 import json
+import os
 import traceback
 
-import tiktoken
-
 import think.prompt as prompt
 import utils.llm as llm
+import utils.log
+from utils.log import DEBUG
 
-from dotenv import load_dotenv
-
-import os
+MEMORIES_FILE = "memories.json"
+RESPONSE_HISTORY_FILE = "response_history.jsonl"
+THOUGHT_HISTORY_FILE = "thought_history.jsonl"
+THOUGHT_SUMMARIES_FILE = "thought_summaries.jsonl"
 
 def log(message):
-    # print with purple color
-    print("\033[94m" + str(message) + "\033[0m")
+    # print with blue color
+    utils.log.log(message, utils.log.BLUE)
 
 
-def count_string_tokens(text, model_name="gpt-3.5-turbo"):
-    """Returns the number of tokens used by a list of messages."""
-    model = model_name
+class HistoryUnavailable(RuntimeError):
+    """Raised when a history can't be loaded or summarized."""
+
+
+def get_encoding(model_name="gpt-3.5-turbo"):
+    """Returns the tiktoken encoding for the given model."""
+    # imported here so startup doesn't pay for tiktoken until we count tokens
+    import tiktoken
+
     try:
-        encoding = tiktoken.encoding_for_model(model)
-        return len(encoding.encode(text))
+        return tiktoken.encoding_for_model(model_name)
     except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    # note: future models may deviate from this
+        # note: future models may deviate from this
+        return tiktoken.get_encoding("cl100k_base")
+
+
+# rough size of a token, used when tiktoken can't load its encoding
+CHARS_PER_TOKEN = 4
+
+
+def try_get_encoding(model_name):
+    """Return the encoding, or None when tiktoken can't provide it (e.g. offline)."""
+    try:
+        return get_encoding(model_name)
     except Exception as e:
-        log(f"Sophie: Error while counting tokens: {e}")
-        log(traceback.format_exc())
+        log(f"Sophie: tiktoken unavailable, estimating tokens from length: {e}")
+        return None
+
+
+def count_string_tokens(text, model_name="gpt-3.5-turbo"):
+    """Returns the number of tokens used by a list of messages."""
+    encoding = try_get_encoding(model_name)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN
+    return len(encoding.encode(text))
+
+
+def truncate_text(text, max_tokens, model_name="gpt-4"):
+    """Keep only the most recent max_tokens tokens of the given text."""
+    encoding = try_get_encoding(model_name)
+    if encoding is None:
+        return text[-max_tokens * CHARS_PER_TOKEN :]
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[-max_tokens:])
 
 
 def summarize_text(text, max_new_tokens=100):
     """
     Summarize the given text using the given LLM model.
     """
-    # Define the prompt for the LLM model.
-
-    load_dotenv()
-    model = os.getenv("MODEL")
-
-    messages = (
+    messages = [
         {
             "role": "system",
             "content": prompt.summarize_conversation,
         },
         {"role": "user", "content": f"Please summarize the following text: {text}"},
-    )
-
-    data = {
-        "mode": "instruct",
-        "model": model,
-        "messages": messages,
-        "user_bio": "",
-        "max_new_tokens": max_new_tokens,
-    }
+    ]
+
     log("Sending to LLM for summary...")
-    response = llm.send(data)
+    response = llm.llm_request(messages, max_new_tokens=max_new_tokens)
     log("LLM answered with summary!")
-    log(json.dumps(response.json()))
+    response_json = response.json()
+    if DEBUG:
+        log(json.dumps(response_json))
     # Extract the summary from the response.
-    summary = response.json()["choices"][0]["message"]["content"]
+    summary = response_json["choices"][0]["message"]["content"]
 
     return summary
 
 
 def chunk_text(text, max_tokens=3000):
     """Split a piece of text into chunks of a certain size."""
+    encoding = try_get_encoding("gpt-4")
     chunks = []
-    chunk = ""
+    chunk = []
+    chunk_tokens = 0
 
     for message in text.split(" "):
-        if (
-            count_string_tokens(str(chunk) + str(message), model_name="gpt-4")
-            <= max_tokens
-        ):
-            chunk += " " + message
+        # count each word once instead of re-encoding the growing chunk
+        if encoding is None:
+            message_tokens = len(" " + message) // CHARS_PER_TOKEN
         else:
-            chunks.append(chunk)
-            chunk = message
-    chunks.append(chunk)  # Don't forget the last chunk!
+            message_tokens = len(encoding.encode(" " + message))
+        if chunk and chunk_tokens + message_tokens > max_tokens:
+            chunks.append(" ".join(chunk))
+            chunk = []
+            chunk_tokens = 0
+        chunk.append(message)
+        chunk_tokens += message_tokens
+    chunks.append(" ".join(chunk))  # Don't forget the last chunk!
     return chunks
 
 
+# sha256 of a chunk -> its summary. The whole history is re-chunked on every
+# cycle, so all but the newest chunks have been summarized before. Least
+# recently used entries are dropped once there are more than SUMMARY_CACHE_SIZE.
+SUMMARY_CACHE_SIZE = 256
+summary_cache = collections.OrderedDict()
+
+
 def summarize_chunks(chunks):
     """Generate a summary for each chunk of text."""
     summaries = []
     print("Summarizing chunks...")
     for chunk in chunks:
+        key = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+        if key in summary_cache:
+            summary_cache.move_to_end(key)
+            summaries.append(summary_cache[key])
+            continue
         try:
-            summaries.append(summarize_text(chunk))
+            summary = summarize_text(chunk)
+            summary_cache[key] = summary
+            if len(summary_cache) > SUMMARY_CACHE_SIZE:
+                summary_cache.popitem(last=False)
+            summaries.append(summary)
         except Exception as e:
             log(f"Error while summarizing text: {e}")
             summaries.append(chunk)  # If summarization fails, use the original text.
     return summaries
 
 
-def get_previous_message_history():
-    """Get the previous message history."""
+# path -> (mtime, size, parsed content) of the last read of each file
+file_cache = {}
+
+
+def load_json_cached(path, parse=json.load):
+    """Load a JSON list from a file, reusing the last parse if the file is unchanged."""
     try:
-        if len(conversation_history) == 0:
-            return "There is no previous message history."
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return []
+    cached = file_cache.get(path)
+    if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+        with open(path, "r") as f:
+            cached = (stat.st_mtime_ns, stat.st_size, parse(f))
+        file_cache[path] = cached
+    # hand out a copy so callers can append without touching the cache
+    return list(cached[2])
 
-        tokens = count_string_tokens(str(self.conversation_history), model_name="gpt-4")
-        if tokens > 3000:
-            log("Message history is over 3000 tokens. Summarizing...")
-            chunks = chunk_text(str(self.conversation_history))
-            summaries = summarize_chunks(chunks)
-            summarized_history = " ".join(summaries)
-            summarized_history += " " + " ".join(self.conversation_history[-6:])
-            return summarized_history
 
-        return conversation_history
-    except Exception as e:
-        log(f"Error while getting previous message history: {e}")
-        log(traceback.format_exc())
-        exit(1)
+def write_atomic(path, payload):
+    """Swap in new file contents at once; a crash never leaves half a file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(payload)
+        # make sure the data is on disk before the new name points at it
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
 
 
-def load_conversation_history(self):
-    """Load the conversation history from a file."""
-    try:
-        with open("conversation_history.json", "r") as f:
-            self.conversation_history = json.load(f)
-    except FileNotFoundError:
-        # If the file doesn't exist, create it.
-        self.conversation_history = []
-    log("Loaded conversation history:")
-    log(self.conversation_history)
+def save_json(path, data):
+    """Write data to a JSON file with a single write call."""
+    write_atomic(path, json.dumps(data))
+    # write-through: the next load sees an unchanged file and skips the parse
+    stat = os.stat(path)
+    file_cache[path] = (stat.st_mtime_ns, stat.st_size, list(data))
+
+
+def parse_jsonl(f):
+    return [json.loads(line) for line in f if line.strip()]
+
+
+def convert_legacy_json(path, legacy_path):
+    """Turn an old single-document JSON list into a JSON-lines file, once."""
+    if not os.path.exists(path) and os.path.exists(legacy_path):
+        save_jsonl(path, load_json_cached(legacy_path))
 
 
-def save_conversation_history(self):
-    """Save the conversation history to a file."""
-    with open("conversation_history.json", "w") as f:
-        json.dump(self.conversation_history, f)
+def load_jsonl_cached(path, legacy_path=None):
+    """Load a JSON-lines file, converting an old single-document file on first use."""
+    if legacy_path:
+        convert_legacy_json(path, legacy_path)
+    return load_json_cached(path, parse=parse_jsonl)
 
 
-def add_to_conversation_history(self, message):
-    """Add a message to the conversation history and save it."""
-    self.conversation_history.append(message)
-    self.save_conversation_history()
+def save_jsonl(path, items):
+    """Rewrite a JSON-lines file with one record per line."""
+    write_atomic(path, "".join(json.dumps(item) + "\n" for item in items))
+    stat = os.stat(path)
+    file_cache[path] = (stat.st_mtime_ns, stat.st_size, list(items))
 
 
-def forget_conversation_history(self):
-    """Forget the conversation history."""
-    self.conversation_history = []
-    self.save_conversation_history()
+def append_jsonl(path, item):
+    """Append one record to a JSON-lines file without rewriting what is there."""
+    extend_jsonl(path, [item])
 
 
+def extend_jsonl(path, items):
+    """Append several records to a JSON-lines file with a single write."""
+    items = list(items)
+    payload = "".join(json.dumps(item) + "\n" for item in items)
+    with open(path, "a") as f:
+        f.write(payload)
+    stat = os.stat(path)
+    cached = file_cache.get(path)
+    if cached is not None and cached[1] + len(payload.encode()) == stat.st_size:
+        # the cache matched the file before this append, so extend it in place
+        cached[2].extend(items)
+        file_cache[path] = (stat.st_mtime_ns, stat.st_size, cached[2])
+    else:
+        file_cache.pop(path, None)
+
 
 def load_memories():
     """Load the memories from a file."""
-    try:
-        memories = []
-        with open("memories.json", "r") as f:
-            memories = json.load(f)
-        return memories
-    except FileNotFoundError:
-        # If the file doesn't exist, create it.
-        return []
+    return load_json_cached(MEMORIES_FILE)
 
 
 def forget_memory(id):
@@ -170,8 +242,7 @@ def forget_memory(id):
 
 def save_memories(history):
     """Save the memories to a file."""
-    with open("memories.json", "w") as f:
-        json.dump(history, f)
+    save_json(MEMORIES_FILE, history)
 
 
 def save_memory(memory):
@@ -202,72 +273,42 @@ def get_response_history():
     except Exception as e:
         log(f"Error while getting previous response history: {e}")
         log(traceback.format_exc())
-        exit(1)
+        raise HistoryUnavailable(e) from e
 
 
 def load_response_history():
     """Load the response history from a file."""
-    try:
-        with open("response_history.json", "r") as f:
-            response_history = json.load(f)
-        return response_history
-    except FileNotFoundError:
-        # If the file doesn't exist, create it with an empty list.
-        return []
+    return load_jsonl_cached(RESPONSE_HISTORY_FILE)
 
 
 def save_response_history(history):
     """Save the response history to a file."""
-    with open("response_history.json", "w") as f:
-        json.dump(history, f)
+    save_jsonl(RESPONSE_HISTORY_FILE, history)
 
 
 def add_to_response_history(question, response):
     """Add a question and its corresponding response to the history."""
-    response_history = load_response_history()
-    response_history.append({"question": question, "response": response})
-    save_response_history(response_history)
-
-
-def get_previous_thought_history():
-    """Get the previous message history."""
-    try:
-        thought_history = load_thought_history()
-        if len(thought_history) == 0:
-            return "There is no previous message history."
-
-        tokens = memory.count_string_tokens(str(thought_history), model_name="gpt-4")
-        if tokens > 200:
-            log("Message history is over 3000 tokens. Summarizing...")
-            chunks = memory.chunk_text(str(thought_history))
-            summaries = memory.summarize_chunks(chunks)
-            summarized_history = " ".join(summaries)
-            summarized_history += " " + " ".join(thought_history[-6:])
-            return summarized_history
-
-        return thought_history
-    except Exception as e:
-        log(f"Error while getting previous message history: {e}")
-        log(traceback.format_exc())
-        exit(1)
+    append_jsonl(RESPONSE_HISTORY_FILE, {"question": question, "response": response})
 
 
 def load_thought_history():
     """Load the thought history from a file."""
-    try:
-        thoughts = []
-        with open("thought_history.json", "r") as f:
-            thoughts = json.load(f)
-        return thoughts
-    except FileNotFoundError:
-        # If the file doesn't exist, create it.
-        return []
+    return load_jsonl_cached(THOUGHT_HISTORY_FILE)
 
 
 def save_thought_history(history):
     """Save the thought history to a file."""
-    with open("thought_history.json", "w") as f:
-        json.dump(history, f)
+    save_jsonl(THOUGHT_HISTORY_FILE, history)
+
+
+def load_thought_summaries():
+    """Load the thought summaries from a file."""
+    return load_jsonl_cached(THOUGHT_SUMMARIES_FILE)
+
+
+def save_thought_summaries(summaries):
+    """Save the thought summaries to a file."""
+    save_jsonl(THOUGHT_SUMMARIES_FILE, summaries)
 
 
 class Thought:
@@ -282,14 +323,16 @@ class Thought:
 
 def save_thought(thought, context=None):
     """Save an individual thought string to the history."""
-    history = load_thought_history()
     log("Summarizing thought to memory...")
     summary = summarize_text(thought)
 
     new_thought = Thought(thought, context, summary).toJSON()
 
-    history.append(new_thought)
-    save_thought_history(history=history)
+    # append one line each instead of rewriting the ever-growing histories
+    append_jsonl(THOUGHT_HISTORY_FILE, new_thought)
+
+    # keep the summaries apart so readers don't have to decode every thought
+    append_jsonl(THOUGHT_SUMMARIES_FILE, summary)
 
 
 def forget_everything():
@@ -297,6 +340,8 @@ def forget_everything():
     print("Forgetting everything...")
     
     save_thought_history(history=[])
+    save_thought_summaries(summaries=[])
     save_response_history(history=[])
     save_memories(history=[])
+    summary_cache.clear()
     print("My memory is empty now, I am ready to learn new things! \n")
@@ -29,21 +29,23 @@ commands = [
 
 
 def get_commands():
-    output = ""
+    parts = []
     for command in commands:
         if command["enabled"] != True:
             continue
         # enabled_status = "Enabled" if command["enabled"] else "Disabled"
-        output += f"Command: {command['name']}\n"
-        output += f"Description: {command['description']}\n"
+        parts.append(f"Command: {command['name']}\n")
+        parts.append(f"Description: {command['description']}\n")
         if command["args"] is not None:
-            output += "Arguments:\n"
-            for arg, description in command["args"].items():
-                output += f"  {arg}: {description}\n"
+            parts.append("Arguments:\n")
+            parts.extend(
+                f"  {arg}: {description}\n"
+                for arg, description in command["args"].items()
+            )
         else:
-            output += "Arguments: None\n"
-        output += "\n"  # For spacing between commands
-    return output.strip()  # Remove the trailing newline for cleaner output
+            parts.append("Arguments: None\n")
+        parts.append("\n")  # For spacing between commands
+    return "".join(parts).strip()  # Remove the trailing newline for cleaner output
 
 
 summarize_conversation = """You are a helpful assistant that summarizes text. Your task is to create a concise running summary of actions and information results in the provided text, focusing on key and potentially important information to remember. Older information is less important, therefor either ignrore it or shorten it to a sentence.
@@ -5,23 +5,34 @@ import utils.llm as llm
 from action.action_decisions import decide, validate_json, extract_json_from_response
 from action.action_execute import take_action
 from utils.log import log, save_debug
+from utils.config import env, as_bool
 
 fail_counter = 0
 
+# long thoughts are cut down before being evaluated to keep the prompt bounded
+MAX_THOUGHT_TOKENS = 1500
+
+# the evaluation pass costs a full extra LLM round-trip on every cycle
+EVALUATE_DECISIONS = env("EVALUATE_DECISIONS", True, as_bool)
+
 def run_think():
     thinking = think()  # takes
     print("THOUGHTS : " + thinking)
     decision = decide(thinking)
     print("DECISIONS : " + str(decision))
-    evaluated_decision = evaluate_decision(thinking, decision)
-    print("EVALUATED DECISION : " + str(evaluated_decision))
+    if EVALUATE_DECISIONS:
+        evaluated_decision = evaluate_decision(thinking, decision)
+        print("EVALUATED DECISION : " + str(evaluated_decision))
+    else:
+        evaluated_decision = decision
     take_action(evaluated_decision)
 
 
 def evaluate_decision(thoughts, decision):
     # combine thoughts and decision and ask llm to evaluate the decision json and output an improved one
     history = llm.build_prompt(prompt.evaluation_prompt)
-    context = f"Thoughts: {thoughts} \n Decision: {decision}"
+    thoughts = memory.truncate_text(thoughts, MAX_THOUGHT_TOKENS)
+    context = f"Thoughts: {thoughts} \n Decision: {json.dumps(decision)}"
     history.append({"role": "user", "content": context})
     response = llm.llm_request(history)
 
@@ -60,8 +71,7 @@ def think():
     log("*** I am thinking... ***")
     history = llm.build_prompt(prompt.thought_prompt)
 
-    thought_history = memory.load_thought_history()
-    thought_summaries = [json.loads(item)["summary"] for item in thought_history]
+    thought_summaries = memory.load_thought_summaries()
 
     history = llm.build_context(
         history=history,
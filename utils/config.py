@@ -0,0 +1,22 @@
+import os
+from dotenv import load_dotenv
+
+# read .env once, on the first import of the settings helpers
+load_dotenv()
+
+
+def env(key, default=None, cast=str):
+    """Read an env var, falling back to default when unset or empty, and cast it."""
+    value = os.getenv(key)
+    if value is not None:
+        value = value.strip()
+    if not value:
+        value = default
+    if value is None:
+        return None
+    return cast(value)
+
+
+def as_bool(value):
+    """Cast for env(): accept 1/true/yes in any case as True."""
+    return str(value).lower() in ("1", "true", "yes")
@@ -1,9 +1,38 @@
 import requests
 from utils.log import log
+from utils.config import env
 import think.memory as memory
-import os
-from dotenv import load_dotenv
 import json
+import time
+
+config = None
+
+# one session for all requests so the connection to the LLM server is kept alive
+session = requests.Session()
+
+
+def get_config():
+    """Read the LLM settings from the environment once and reuse them."""
+    global config
+    if config is None:
+        config = {
+            "api_url": env("API_URL"),
+            "model": env("MODEL"),
+            "temperature": env("TEMPERATURE", 0.6, float),
+            "max_tokens": env("MAX_TOKENS", 4192, int),
+            "truncation_length": env("TRUNCATION_LENGTH"),
+            "max_new_tokens": env("MAX_NEW_TOKENS"),
+            "request_timeout": env("LLM_TIMEOUT", 300, float),
+            "max_retries": env("LLM_MAX_RETRIES", 3, int),
+        }
+    return config
+
+
+def reset_config():
+    """Forget the cached settings so the next request reads them again."""
+    global config
+    config = None
+
 
 def one_shot_request(prompt, system_context):
     history = []
@@ -17,66 +46,106 @@ def one_shot_request(prompt, system_context):
         return None
 
 
-def llm_request(history):
-    load_dotenv()
-    model = os.getenv("MODEL")
-    temperature = os.getenv("TEMPERATURE")
-    max_tokens = os.getenv("MAX_TOKENS")
-    truncation_length = os.getenv("TRUNCATION_LENGTH")
-    max_new_tokens = os.getenv("MAX_NEW_TOKENS")
+def llm_request(history, max_new_tokens=None):
+    config = get_config()
 
     data = {
         "mode": "instruct",
-        "model": model,
+        "model": config["model"],
         "messages": history,
-        "temperature": float(temperature),
+        "temperature": config["temperature"],
         "user_bio": "",
-        "max_tokens": int(max_tokens),
-        "truncation_length": truncation_length,
-        "max_new_tokens": max_new_tokens,
+        "max_tokens": config["max_tokens"],
+        "truncation_length": config["truncation_length"],
+        "max_new_tokens": max_new_tokens or config["max_new_tokens"],
     }
     return send(data=data)
 
 
 def send(data):
-    # load environment variables
-    load_dotenv()
-    api_url = os.getenv("API_URL")
+    config = get_config()
 
     headers = {"Content-Type": "application/json"}
 
-    try:
-        # log("sending: "+json.dumps(data))
-        response = requests.post(api_url, headers=headers, json=data)
-        return response
-    except Exception as e:
-        log("Exception when talking to API:")
-        log(e)
-        exit(1)
+    # max_retries counts retries after the first attempt, 0 disables retrying
+    attempts = max(config["max_retries"], 0) + 1
+    for attempt in range(attempts):
+        try:
+            # log("sending: "+json.dumps(data))
+            response = session.post(
+                config["api_url"],
+                headers=headers,
+                json=data,
+                timeout=config["request_timeout"],
+            )
+            return response
+        except (requests.Timeout, requests.ConnectionError) as e:
+            # a hung or restarting server should not stall the agent forever
+            if attempt + 1 >= attempts:
+                log("Exception when talking to API:")
+                log(e)
+                raise RuntimeError(f"LLM request failed: {e}") from e
+            log(f"LLM request failed, retrying... ({e})")
+            time.sleep(2**attempt * 0.5)
+        except Exception as e:
+            log("Exception when talking to API:")
+            log(e)
+            raise RuntimeError(f"LLM request failed: {e}") from e
 
 
-def build_context(history, conversation_history, message_history):
-    context = ""
-    if conversation_history:
-        context += "Context:\n"
-        for convo in conversation_history:
-            if convo:
-                context += str(convo)
-    if message_history:
-        context += "\nMessages:\n"
-        for message in message_history:
-            if message:
-                context += str(message)
+def to_text(item):
+    """Render a history entry for the prompt, dicts as JSON rather than repr."""
+    if isinstance(item, str):
+        return item
+    if isinstance(item, dict):
+        return json.dumps(item, ensure_ascii=False)
+    return str(item)
+
+
+def build_context(history, conversation_history, message_history, max_tokens=2000):
+    # memories change rarely, so they go right after the system prompt as one
+    # message of their own; that keeps the start of the prompt identical across
+    # calls and lets servers with prefix caching reuse it
     memories = memory.load_memories()
     if memories:
-        context += "\nMemories:\n"
-        for mem in memories:
-            context += mem
+        history.append(
+            {
+                "role": "system",
+                "content": "Memories:\n" + "\n".join(memories),
+            }
+        )
+
+    # collect the pieces and join them once instead of growing a string
+    parts = []
+    if conversation_history:
+        if isinstance(conversation_history, str):
+            conversation = conversation_history
+        else:
+            # the list only ever grows: walk back from the newest entry and stop
+            # once the budget is covered, so older entries are never tokenized
+            recent = []
+            budget = max_tokens
+            for convo in reversed(conversation_history):
+                if not convo:
+                    continue
+                text = to_text(convo)
+                recent.append(text)
+                budget -= memory.count_string_tokens(text, model_name="gpt-4")
+                if budget <= 0:
+                    break
+            conversation = "".join(reversed(recent))
+        # older context grows without bound, only keep the most recent part
+        parts.append("Context:\n")
+        parts.append(memory.truncate_text(conversation, max_tokens))
+    if message_history:
+        parts.append("\nMessages:\n")
+        parts.extend(to_text(message) for message in message_history if message)
+    context = "".join(parts)
     if context:
         history.append(
             {
                 "role": "user",
-                "content": str(context),
+                "content": context,
             }
         )
     return history
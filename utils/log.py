@@ -1,13 +1,33 @@
 import json
+import sys
+from utils.config import env, as_bool
 
 
-def log(message):
-    # print with white color
-    print("\033[0m" + str(message) + "\033[0m")
+# read once at import, debug dumps are skipped entirely when disabled
+DEBUG = env("DEBUG", False, as_bool)
+
+# colour codes only make sense on a terminal, piped output gets plain text
+IS_TTY = sys.stdout.isatty()
+
+
+WHITE = "\033[0m"
+BLUE = "\033[94m"
+PURPLE = "\033[95m"
+RESET = "\033[0m"
+
+
+def log(message, color=WHITE):
+    # print with the given color, white by default
+    if IS_TTY:
+        sys.stdout.write(color + str(message) + RESET + "\n")
+    else:
+        sys.stdout.write(str(message) + "\n")
 
 
 def save_debug(data, response):
     """Save the debug to a file."""
+    if not DEBUG:
+        return
     with open("debug_data.json", "w") as f:
         json.dump(data, f)
     with open("debug_response.json", "w") as f:
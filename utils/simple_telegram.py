@@ -1,16 +1,80 @@
+from __future__ import annotations
+
 import asyncio
-import json
+import collections
 import os
 import random
+import threading
+import time
 import traceback
+from typing import TYPE_CHECKING
 from telegram import Bot, Update
-from telegram.error import TimedOut
-from telegram.ext import CallbackContext
+from telegram.error import RetryAfter, TimedOut
+from telegram.request import HTTPXRequest
 import think.memory as memory
+import utils.log
+from utils.config import env
+
+if TYPE_CHECKING:
+    # telegram.ext is heavy and only needed for the handle_response annotation
+    from telegram.ext import CallbackContext
 
 
 response_queue = ""
 
+# warn each unauthorized chat at most once per interval (seconds)
+UNAUTHORIZED_WARNING_INTERVAL = 3600
+UNAUTHORIZED_MESSAGE = "You are not authorized to use this bot. Checkout Auto-GPT-Plugins on GitHub: https://github.com/Significant-Gravitas/Auto-GPT-Plugins"
+
+CONVERSATION_HISTORY_FILE = "conversation_history.jsonl"
+LEGACY_CONVERSATION_HISTORY_FILE = "conversation_history.json"
+
+# long-poll timeout in seconds; the server answers as soon as an update arrives
+POLL_TIMEOUT = 50
+# only wake up for plain messages, not edits, reactions, member changes, ...
+ALLOWED_UPDATES = ["message"]
+# upper bound in seconds for the retry delay after consecutive polling errors
+MAX_POLL_BACKOFF = 30
+# how often ask_user re-sends its prompt after Telegram timeouts
+ASK_USER_RETRIES = 5
+# stay under Telegram's bot-wide flood limit: at most this many sends per window
+SEND_RATE_LIMIT = 30
+SEND_RATE_WINDOW = 1.0
+
+
+telegram_config = None
+
+
+def get_telegram_config():
+    """Return (api_key, chat_id), reading the environment only on the first call."""
+    global telegram_config
+    if telegram_config is None:
+        telegram_config = (
+            env("TELEGRAM_API_KEY"),
+            env("TELEGRAM_CHAT_ID"),
+        )
+    return telegram_config
+
+
+def invalidate_config():
+    """Forget the cached Telegram config so the next call re-reads it."""
+    global telegram_config
+    telegram_config = None
+
+
+background_loop = None
+
+
+def get_background_loop():
+    """Start the shared event loop thread on first use and return its loop."""
+    global background_loop
+    if background_loop is None:
+        if os.name == "nt":
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+        background_loop = asyncio.new_event_loop()
+        threading.Thread(target=background_loop.run_forever, daemon=True).start()
+    return background_loop
+
 
 def run_async(coro):
     try:
@@ -20,18 +84,52 @@ def run_async(coro):
     if loop and loop.is_running():
         return loop.create_task(coro)
     else:
-        if os.name == "nt":
-            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-        return asyncio.run(coro)
+        # one long-lived loop instead of asyncio.run per call, so the cached bot
+        # and its keep-alive connections survive between calls
+        return asyncio.run_coroutine_threadsafe(coro, get_background_loop()).result()
+
+
+def submit_async(coro):
+    """Schedule coro on the shared loop without waiting for its result."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_background_loop())
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        log(f"Error in background Telegram call: {future.exception()}")
 
 
 def log(message):
     # print with purple color
-    print("\033[95m" + str(message) + "\033[0m")
+    utils.log.log(message, utils.log.PURPLE)
 
 
 class TelegramUtils:
+    __slots__ = (
+        "api_key",
+        "chat_id",
+        "_chat_id_int",
+        "_bot",
+        "_bot_loop",
+        "_last_update_id",
+        "_send_lock",
+        "_send_times",
+        "_warned_chats",
+        "conversation_history",
+    )
+
     def __init__(self, api_key: str = None, chat_id: str = None):
+        self._bot = None
+        self._bot_loop = None
+        self._send_lock = None
+        self._send_times = collections.deque()
+        # highest update id handed out so far; passing it + 1 as the offset
+        # confirms it to Telegram so it is never delivered again
+        self._last_update_id = -1
+        self._warned_chats = {}
+
         if not api_key:
             log(
                 "No api key provided. Please set the TELEGRAM_API_KEY environment variable."
@@ -72,11 +170,13 @@ class TelegramUtils:
                         "Error while sending test message. Please check your Telegram bot."
                     )
         self.chat_id = chat_id
+        # parsed once, every incoming update is checked against it
+        self._chat_id_int = int(chat_id) if chat_id else None
         self.load_conversation_history()
 
     def get_last_few_messages(self):
         """Interface method. Get the last few messages."""
-        self.load_conversation_history()
+        # the in-memory history is kept in sync by add_to_conversation_history
         return self.conversation_history[-10:]
 
     def get_previous_message_history(self):
@@ -99,62 +199,92 @@ class TelegramUtils:
         except Exception as e:
             log(f"Error while getting previous message history: {e}")
             log(traceback.format_exc())
-            exit(1)
+            raise memory.HistoryUnavailable(e) from e
 
     def load_conversation_history(self):
         """Load the conversation history from a file."""
-        try:
-            with open("conversation_history.json", "r") as f:
-                self.conversation_history = json.load(f)
-        except FileNotFoundError:
-            # If the file doesn't exist, create it.
-            self.conversation_history = []
+        self.conversation_history = memory.load_jsonl_cached(
+            CONVERSATION_HISTORY_FILE, LEGACY_CONVERSATION_HISTORY_FILE
+        )
 
     def save_conversation_history(self):
-        """Save the conversation history to a file."""
-        with open("conversation_history.json", "w") as f:
-            json.dump(self.conversation_history, f)
+        """Rewrite the whole conversation history file, one message per line."""
+        memory.save_jsonl(CONVERSATION_HISTORY_FILE, self.conversation_history)
 
     def add_to_conversation_history(self, message):
         """Add a message to the conversation history and save it."""
-        self.conversation_history.append(message)
-        self.save_conversation_history()
+        self.extend_conversation_history([message])
+
+    def extend_conversation_history(self, messages):
+        """Add several messages to the conversation history with a single write."""
+        messages = list(messages)
+        if not messages:
+            return
+        self.conversation_history.extend(messages)
+        # append lines instead of rewriting the whole history every time
+        memory.extend_jsonl(CONVERSATION_HISTORY_FILE, messages)
 
     def poll_anyMessage(self):
         print("Waiting for first message...")
         return run_async(self.poll_anyMessage_async())
 
     async def poll_anyMessage_async(self):
-        bot = Bot(token=self.api_key)
-        last_update = await bot.get_updates(timeout=30)
+        bot = await self.get_bot()
+        # prime with a short poll: only collect what is already pending
+        last_update = await bot.get_updates(timeout=0, allowed_updates=ALLOWED_UPDATES)
         if len(last_update) > 0:
-            last_update_id = last_update[-1].update_id
+            last_update_id = max(u.update_id for u in last_update)
         else:
             last_update_id = -1
 
+        backoff = 1
         while True:
             try:
                 log("Waiting for first message...")
-                updates = await bot.get_updates(offset=last_update_id + 1, timeout=30)
+                updates = await bot.get_updates(
+                    offset=last_update_id + 1,
+                    timeout=POLL_TIMEOUT,
+                    allowed_updates=ALLOWED_UPDATES,
+                )
+                backoff = 1
                 for update in updates:
                     if update.message:
                         return update
             except Exception as e:
                 log(f"Error while polling updates: {e}")
-
-            await asyncio.sleep(1)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_POLL_BACKOFF)
 
     def is_authorized_user(self, update: Update):
-        authorized = update.effective_user.id == int(self.chat_id)
-        if not authorized:
-            log("Unauthorized user: " + str(update))
-            chat_id = update.message.chat.id
-            temp_bot = Bot(self.api_key)
-            temp_bot.send_message(
-                chat_id=chat_id,
-                text="You are not authorized to use this bot. Checkout Auto-GPT-Plugins on GitHub: https://github.com/Significant-Gravitas/Auto-GPT-Plugins",
-            )
-        return authorized
+        user = update.effective_user
+        if user is not None and user.id == self._chat_id_int:
+            return True
+        log("Unauthorized user: " + str(user.id if user else update))
+        if update.message and self._should_warn(update.message.chat.id):
+            submit_async(self._send_unauthorized_message(update.message.chat.id))
+        return False
+
+    def _should_warn(self, chat_id):
+        """Rate-limit unauthorized warnings so a spamming chat can't flood the bot."""
+        now = time.monotonic()
+        last_warned = self._warned_chats.get(chat_id)
+        if last_warned is not None and now - last_warned < UNAUTHORIZED_WARNING_INTERVAL:
+            return False
+        if len(self._warned_chats) > 1000:
+            self._warned_chats = {
+                c: t
+                for c, t in self._warned_chats.items()
+                if now - t < UNAUTHORIZED_WARNING_INTERVAL
+            }
+        self._warned_chats[chat_id] = now
+        return True
+
+    async def _send_unauthorized_message(self, chat_id):
+        try:
+            bot = await self.get_bot()
+            await bot.send_message(chat_id=chat_id, text=UNAUTHORIZED_MESSAGE)
+        except Exception as e:
+            log(f"Error while warning unauthorized user: {e}")
 
     def handle_response(self, update: Update, context: CallbackContext):
         try:
@@ -166,12 +296,39 @@ class TelegramUtils:
             log(e)
 
     async def get_bot(self):
-        bot_token = self.api_key
-        bot = Bot(token=bot_token)
+        # reuse the bot and its connection pool, but only on the loop it was
+        # created on: its http client can't be shared across event loops
+        loop = asyncio.get_running_loop()
+        if self._bot is None or self._bot_loop is not loop:
+            self._bot = Bot(
+                token=self.api_key,
+                request=HTTPXRequest(
+                    connection_pool_size=4,
+                    connect_timeout=10,
+                    read_timeout=10,
+                    write_timeout=20,
+                ),
+                # a separate single connection for long polls, so a pending
+                # get_updates never holds up send_message. get_updates adds its
+                # own timeout to read_timeout, so this is only the margin.
+                get_updates_request=HTTPXRequest(
+                    connection_pool_size=1,
+                    connect_timeout=10,
+                    read_timeout=5,
+                ),
+            )
+            self._bot_loop = loop
         # commands = await bot.get_my_commands()
         # if len(commands) == 0:
         #     await self.set_commands(bot)
-        return bot
+        return self._bot
+
+    async def aclose(self):
+        """Release the cached bot's connection pool."""
+        if self._bot is not None:
+            await self._bot.shutdown()
+            self._bot = None
+            self._bot_loop = None
 
     def _send_message(self, message, speak=False):
         try:
@@ -185,20 +342,47 @@ class TelegramUtils:
     async def _send_message_async(self, message, speak=False):
         log("Sending message on Telegram: " + str(message))
         recipient_chat_id = self.chat_id
-        bot = await self.get_bot()
-
-        # properly handle messages with more than 2000 characters by chunking them
-        if len(message) > 2000:
-            message_chunks = [
-                message[i : i + 2000] for i in range(0, len(message), 2000)
-            ]
-            for message_chunk in message_chunks:
-                await bot.send_message(chat_id=recipient_chat_id, text=message_chunk)
-        else:
-            await bot.send_message(chat_id=recipient_chat_id, text=message)
+        # sends may be queued without waiting for them; the lock is fair, so
+        # messages still reach the chat in the order they were submitted
+        if self._send_lock is None:
+            self._send_lock = asyncio.Lock()
+        async with self._send_lock:
+            bot = await self.get_bot()
+
+            # properly handle messages with more than 2000 characters by chunking them
+            if len(message) > 2000:
+                # slice lazily and send in order; telegram may reorder concurrent sends
+                for i in range(0, len(message), 2000):
+                    await self._send_throttled(
+                        bot, recipient_chat_id, message[i : i + 2000]
+                    )
+            else:
+                await self._send_throttled(bot, recipient_chat_id, message)
         if speak:
             await self._speech(message)
 
+    async def _send_throttled(self, bot, chat_id, text):
+        # callers hold _send_lock, so the window needs no locking of its own
+        now = time.monotonic()
+        while self._send_times and now - self._send_times[0] >= SEND_RATE_WINDOW:
+            self._send_times.popleft()
+        if len(self._send_times) >= SEND_RATE_LIMIT:
+            await asyncio.sleep(SEND_RATE_WINDOW - (now - self._send_times[0]))
+            self._send_times.popleft()
+        self._send_times.append(time.monotonic())
+        try:
+            return await bot.send_message(chat_id=chat_id, text=text)
+        except RetryAfter as e:
+            # flood control: wait exactly as long as Telegram asks, then try
+            # once more; a second refusal is raised so the lock isn't held
+            retry_after = e.retry_after
+            if hasattr(retry_after, "total_seconds"):  # timedelta in newer PTB
+                retry_after = retry_after.total_seconds()
+            log(f"Telegram flood control, retrying in {retry_after}s")
+            await asyncio.sleep(retry_after)
+        self._send_times.append(time.monotonic())
+        return await bot.send_message(chat_id=chat_id, text=text)
+
     async def ask_user_async(self, prompt, speak=False):
         global response_queue
 
@@ -222,68 +406,73 @@ class TelegramUtils:
         bot = await self.get_bot()
         log("getting updates...")
 
-        last_update = await bot.get_updates(timeout=10)
+        # prime with a short poll: only collect what arrived since the last call
+        last_update = await bot.get_updates(
+            offset=self._last_update_id + 1,
+            timeout=0,
+            allowed_updates=ALLOWED_UPDATES,
+        )
         if len(last_update) > 0:
-            last_messages = []
-            for u in last_update:
-                if not self.is_authorized_user(u):
-                    continue
-                if u.message and u.message.text:
-                    last_messages.append(u.message.text)
-                else:
-                    log("no text in message in update: " + str(u))
-            last_messages = []
-            for u in last_update:
-                if not self.is_authorized_user(u):
-                    continue
-                if u.message:
-                    if u.message.text:
-                        last_messages.append(u.message.text)
-                    else:
-                        log("no text in message in update: " + str(u))
-            # itarate and check if last messages are already known, if not add to history
-            for message in last_messages:
-                self.add_to_conversation_history("User: " + message)
+            last_messages = [
+                u.message.text
+                for u in last_update
+                if self.is_authorized_user(u) and u.message and u.message.text
+            ]
+            self.extend_conversation_history("User: " + m for m in last_messages)
 
             log("last messages: " + str(last_messages))
-            last_update_id = last_update[-1].update_id
-
-        else:
-            last_update_id = -11
+            self._last_update_id = max(
+                self._last_update_id, max(u.update_id for u in last_update)
+            )
 
-        log("last update id: " + str(last_update_id))
+        log("last update id: " + str(self._last_update_id))
         log("Waiting for new messages...")
+        backoff = 1
         while True:
             try:
-                updates = await bot.get_updates(offset=last_update_id + 1, timeout=30)
+                updates = await bot.get_updates(
+                    offset=self._last_update_id + 1,
+                    timeout=POLL_TIMEOUT,
+                    allowed_updates=ALLOWED_UPDATES,
+                )
+                backoff = 1
                 for update in updates:
+                    # advance before handling, so the update we return is
+                    # confirmed too; later ones in the batch are picked up
+                    # by the next call's priming poll
+                    self._last_update_id = max(self._last_update_id, update.update_id)
                     if self.is_authorized_user(update):
                         if update.message and update.message.text:
                             response_queue = update.message.text
                             self.add_to_conversation_history("User: " + response_queue)
                             return response_queue
-
-                    last_update_id = max(last_update_id, update.update_id)
             except TimedOut:
                 continue
             except Exception as e:
                 log(f"Error while polling updates: {e}")
-
-            await asyncio.sleep(1)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, MAX_POLL_BACKOFF)
 
     def send_message(self, message):
         """Interface method for sending a message."""
         self.add_to_conversation_history("Sent: " + message)
-        self._send_message(message + "...")
+        # don't block the agent on the round trip to Telegram
+        submit_async(self._send_message_async(message + "..."))
         return "Sent message successfully."
 
     def ask_user(self, prompt):
         """Interface Method for Auto-GPT.
         Ask the user a question, return the answer"""
-        answer = "User has not answered."
-        try:
-            answer = run_async(self.ask_user_async(prompt=prompt))
-        except TimedOut:
-            log("Telegram timeout error, trying again...")
-            answer = self.ask_user(prompt=prompt)
-        return answer
+        return run_async(self._ask_user_with_retry(prompt=prompt))
+
+    async def _ask_user_with_retry(self, prompt):
+        # back off on the loop instead of recursing from the calling thread
+        backoff = 0.5
+        for _ in range(ASK_USER_RETRIES):
+            try:
+                return await self.ask_user_async(prompt=prompt)
+            except TimedOut:
+                log("Telegram timeout error, trying again...")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 4)
+        return "User has not answered."
@@ -4,8 +4,6 @@ import json
 import time
 from itertools import islice
 
-from duckduckgo_search import DDGS
-
 COMMAND_CATEGORY = "web_search"
 COMMAND_CATEGORY_TITLE = "Web Search"
 
@@ -22,6 +20,9 @@ def web_search(query: str, num_results: int = 2) -> str:
     Returns:
         str: The results of the search.
     """
+
+    from duckduckgo_search import DDGS
+
     print("**********************starting search! **********************")
     search_results = []
     attempts = 0